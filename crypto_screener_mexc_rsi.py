@@ -1,13 +1,26 @@
 # crypto_screener_mexc_rsi.py
+import asyncio
 import time
+import aiohttp
+import orjson
 import requests
-from datetime import datetime
-import pandas as pd
+from datetime import datetime, timezone
+import numpy as np
 import os
-import json
 from pathlib import Path
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from aiolimiter import AsyncLimiter
+
+try:
+    from numba import njit, prange
+except ImportError:  # pure-Python fallback, same results just slower
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
 
 # ──────────────────────────────────────────────
 # CONFIGURATION
@@ -15,10 +28,22 @@ from urllib3.util.retry import Retry
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 STATE_FILE = Path("state.json")
+CLOSES_FILE = Path("closes.dat")
+CLOSES_INDEX_FILE = Path("closes_index.json")
 TOP_N = 150
 RSI_PERIOD = 14
 RSI_OVERBOUGHT = 80.0
 KLINES_LIMIT = 50
+KLINES_CONCURRENCY = 20
+MEXC_MAX_RPM = 60
+HTTP_POOL_SIZE = 16
+KLINES_INTERVAL_SECONDS = 4 * 3600
+HTTP_RETRIES = 5
+HTTP_BACKOFF = 0.3  # short: long waits come from Retry-After on 429s
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TELEGRAM_CHUNK_CHARS = 4000  # Telegram caps a message at 4096 chars
+ALERT_SEPARATOR = "\n---\n"
+TELEGRAM_MIN_INTERVAL = 1.1  # seconds between messages to the same chat
 
 ALERT_TEMPLATE = """
 Symbol: {symbol}
@@ -30,8 +55,20 @@ Link: https://www.mexc.co/futures/{symbol}
 
 # Setup retry session
 session = requests.Session()
-retry = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-adapter = HTTPAdapter(max_retries=retry)
+retry = Retry(
+    total=HTTP_RETRIES,
+    backoff_factor=HTTP_BACKOFF,
+    status_forcelist=RETRY_STATUSES,
+    respect_retry_after_header=True,
+    allowed_methods=frozenset(["GET"]),
+    raise_on_status=False,
+)
+adapter = HTTPAdapter(
+    pool_connections=HTTP_POOL_SIZE,
+    pool_maxsize=HTTP_POOL_SIZE,
+    pool_block=True,
+    max_retries=retry,
+)
 session.mount('http://', adapter)
 session.mount('https://', adapter)
 
@@ -43,9 +80,9 @@ def load_state() -> dict | None:
         print("No state file found → treating as reset")
         return None
     try:
-        with open(STATE_FILE, "r") as f:
-            data = json.load(f)
-        print(f"Loaded state: last reset {datetime.fromtimestamp(data['last_reset_time'])} UTC, "
+        with open(STATE_FILE, "rb") as f:
+            data = orjson.loads(f.read())
+        print(f"Loaded state: last reset {datetime.fromtimestamp(data['last_reset_time'], timezone.utc):%Y-%m-%d %H:%M:%S} UTC, "
               f"{len(data.get('alerted_symbols', []))} symbols")
         return data
     except Exception as e:
@@ -54,29 +91,127 @@ def load_state() -> dict | None:
 
 def save_state(state: dict):
     try:
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f, indent=2)
+        with open(STATE_FILE, "wb") as f:
+            f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
         print("State saved to state.json")
     except Exception as e:
         print(f"State save failed: {e}")
 
+# ──────────────────────────────────────────────
+# CLOSES STORE (mmap'd ring buffer, one row per symbol)
+# ──────────────────────────────────────────────
+def load_closes_store() -> tuple[np.memmap, dict]:
+    """Open the (TOP_N, KLINES_LIMIT) closes memmap and its symbol index.
+
+    Index entries are {"row", "last_time", "count"}; rows are right-aligned,
+    newest close last. A missing or mismatched store is recreated empty.
+    """
+    shape = (TOP_N, KLINES_LIMIT)
+    expected_size = TOP_N * KLINES_LIMIT * np.dtype(np.float64).itemsize
+    if (CLOSES_FILE.exists() and CLOSES_INDEX_FILE.exists()
+            and CLOSES_FILE.stat().st_size == expected_size):
+        try:
+            index = orjson.loads(CLOSES_INDEX_FILE.read_bytes())
+            return np.memmap(CLOSES_FILE, dtype=np.float64, mode="r+", shape=shape), index
+        except Exception as e:
+            print(f"Closes store load failed: {e} → rebuilding")
+    print("No usable closes store → full kline fetch")
+    return np.memmap(CLOSES_FILE, dtype=np.float64, mode="w+", shape=shape), {}
+
+def save_closes_store(closes_mm: np.memmap, index: dict):
+    try:
+        closes_mm.flush()
+        CLOSES_INDEX_FILE.write_bytes(orjson.dumps(index))
+    except Exception as e:
+        print(f"Closes store save failed: {e}")
+
+def assign_rows(index: dict, symbols: list[str]) -> dict:
+    """Keep rows of symbols still scanned and give free rows to new ones."""
+    kept = {s: index[s] for s in symbols if s in index}
+    free = sorted(set(range(TOP_N)) - {e["row"] for e in kept.values()})
+    for s in symbols:
+        if s not in kept:
+            kept[s] = {"row": free.pop(0), "last_time": 0, "count": 0}
+    return kept
+
+def fetch_start(entry: dict) -> int | None:
+    """Open time to fetch from, or None when the row needs a full refill."""
+    max_gap = (KLINES_LIMIT - 1) * KLINES_INTERVAL_SECONDS
+    if entry["count"] and time.time() - entry["last_time"] < max_gap:
+        return entry["last_time"]
+    return None
+
+def update_closes_row(row: np.ndarray, entry: dict, times: np.ndarray, closes: np.ndarray):
+    """Merge fetched candles into a row: shift left by the number of new
+    candles, then overwrite the tail (including the still-forming candle)."""
+    last_time = entry["last_time"] if entry["count"] else -1
+    keep = times >= last_time
+    times, closes = times[keep], closes[keep]
+    if not len(times):
+        return
+    shift = int((times > last_time).sum())
+    if shift:
+        row[:-shift] = row[shift:]
+    tail = closes[-len(row):]
+    row[len(row) - len(tail):] = tail
+    entry["count"] = min(entry["count"] + shift, len(row))
+    entry["last_time"] = int(times[-1])
+
 # ──────────────────────────────────────────────
 # RSI CALCULATION
 # ──────────────────────────────────────────────
-def calculate_rsi(series: pd.Series, period: int = 14) -> pd.Series:
-    delta = series.diff()
-    gain = delta.where(delta > 0, 0)
-    loss = -delta.where(delta < 0, 0)
-    avg_gain = gain.ewm(com=period-1, min_periods=period, adjust=False).mean()
-    avg_loss = loss.ewm(com=period-1, min_periods=period, adjust=False).mean()
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
+def make_rsi(period: int):
+    """Build a latest_rsi kernel with `period` baked in.
+
+    Numba treats the closed-over values as compile-time constants, so the
+    Wilder divisions become multiplies and the seed loop has a fixed trip count.
+    Accumulators are float32 to match the float32 batch matrix.
+    """
+    inv_p = np.float32(1.0 / period)
+    p_m1 = np.float32(period - 1)
+    zero = np.float32(0.0)
+
+    @njit(cache=True, fastmath=True, nogil=True)
+    def latest_rsi(closes: np.ndarray) -> float:
+        # Wilder smoothing seeded with a simple mean; only the last value is needed
+        ag = zero
+        al = zero
+        for i in range(1, period + 1):
+            d = closes[i] - closes[i - 1]
+            if d > 0:
+                ag += d
+            else:
+                al -= d
+        ag *= inv_p
+        al *= inv_p
+        for i in range(period + 1, len(closes)):
+            d = closes[i] - closes[i - 1]
+            ag = (ag * p_m1 + max(d, zero)) * inv_p
+            al = (al * p_m1 + max(-d, zero)) * inv_p
+        if al == 0:
+            # flat series (halted/delisted contract) is not overbought
+            return 100.0 if ag > 0 else 0.0
+        return 100.0 - 100.0 / (1.0 + ag / al)
+
+    return latest_rsi
+
+latest_rsi = make_rsi(RSI_PERIOD)
+
+@njit(parallel=True, fastmath=True, cache=True)
+def rsi_last_batch(mat: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # Row i holds lengths[i] closes right-aligned (see update_closes_row).
+    # Module-level so it references latest_rsi as a global: a closure over the
+    # dispatcher makes Numba's cache key differ per process.
+    n, width = mat.shape
+    out = np.empty(n)
+    for i in prange(n):
+        out[i] = latest_rsi(mat[i, width - lengths[i]:])
+    return out
 
 # ──────────────────────────────────────────────
 # TELEGRAM SEND
 # ──────────────────────────────────────────────
-def send_telegram(msg: str) -> bool:
+async def send_telegram(http: aiohttp.ClientSession, limiter: AsyncLimiter, msg: str) -> bool:
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = {
         "chat_id": TELEGRAM_CHAT_ID,
@@ -84,13 +219,45 @@ def send_telegram(msg: str) -> bool:
         "parse_mode": "HTML",
         "disable_notification": False,
     }
+    # Only 429 is retried: Telegram guarantees the message was not sent, whereas a
+    # gateway 5xx may arrive after delivery and a resend would duplicate the alert.
     try:
-        r = session.post(url, json=payload, timeout=10)
-        return r.status_code == 200
+        for attempt in range(HTTP_RETRIES + 1):
+            async with limiter:
+                async with http.post(url, json=payload) as r:
+                    if r.status != 429 or attempt == HTTP_RETRIES:
+                        return r.status == 200
+                    retry_after = r.headers.get("Retry-After", "")
+                    if not retry_after.isdigit():
+                        try:
+                            body = orjson.loads(await r.read())
+                            retry_after = (body.get("parameters") or {}).get("retry_after", "")
+                        except orjson.JSONDecodeError:
+                            pass
+            retry_after = str(retry_after)
+            delay = float(retry_after) if retry_after.isdigit() else HTTP_BACKOFF * 2 ** attempt
+            print(f"Telegram send got {r.status} → retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
     except Exception as e:
         print(f"Telegram send failed: {e}")
         return False
 
+async def send_alerts(http: aiohttp.ClientSession, limiter: AsyncLimiter,
+                      messages: list[str]) -> list[bool]:
+    """Send chunks one after another so they arrive in order, paced per chat."""
+    return [await send_telegram(http, limiter, chunk) for chunk in chunk_messages(messages)]
+
+def chunk_messages(messages: list[str], limit: int = TELEGRAM_CHUNK_CHARS):
+    """Join messages with ALERT_SEPARATOR into chunks of at most `limit` chars."""
+    chunk = ""
+    for msg in messages:
+        if chunk and len(chunk) + len(ALERT_SEPARATOR) + len(msg) > limit:
+            yield chunk
+            chunk = ""
+        chunk = f"{chunk}{ALERT_SEPARATOR}{msg}" if chunk else msg
+    if chunk:
+        yield chunk
+
 # ──────────────────────────────────────────────
 # GET TOP TICKERS + KLINES
 # ──────────────────────────────────────────────
@@ -99,7 +266,7 @@ def get_futures_tickers() -> list[dict]:
     try:
         r = session.get(url, timeout=12)
         r.raise_for_status()
-        data = r.json()
+        data = orjson.loads(r.content)
         tickers = data.get("data", [])
         if isinstance(tickers, dict):
             tickers = [tickers]
@@ -107,38 +274,51 @@ def get_futures_tickers() -> list[dict]:
             t for t in tickers
             if isinstance(t, dict) and str(t.get("symbol", "")).endswith("_USDT")
         ]
-        usdt_perps.sort(key=lambda x: float(x.get("amount24", 0)), reverse=True)
-        return usdt_perps[:TOP_N]
+        vols = np.fromiter(
+            (float(t.get("amount24") or 0) for t in usdt_perps),
+            dtype=np.float64,
+            count=len(usdt_perps),
+        )
+        # O(n) top-N selection, then sort just those N by volume
+        top_idx = np.arange(len(vols))
+        if len(vols) > TOP_N:
+            top_idx = np.argpartition(-vols, TOP_N)[:TOP_N]
+        top_idx = top_idx[np.argsort(-vols[top_idx], kind="stable")]
+        return [usdt_perps[i] for i in top_idx]
     except Exception as e:
         print(f"Error fetching tickers: {e}")
         return []
 
-def get_4h_klines(symbol: str) -> pd.DataFrame | None:
+async def get_4h_klines(http: aiohttp.ClientSession, sem: asyncio.Semaphore,
+                        limiter: AsyncLimiter, symbol: str,
+                        start: int | None = None) -> tuple[np.ndarray, np.ndarray] | None:
+    """Return (open_times, closes) sorted by time, from `start` if given."""
     url = f"https://contract.mexc.com/api/v1/contract/kline/{symbol}"
     params = {"interval": "Hour4", "limit": KLINES_LIMIT}
+    if start is not None:
+        params["start"] = start
     try:
-        r = session.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json()
+        for attempt in range(HTTP_RETRIES + 1):
+            async with sem, limiter:
+                async with http.get(url, params=params) as r:
+                    if r.status not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                        r.raise_for_status()
+                        data = orjson.loads(await r.read())
+                        break
+                    retry_after = r.headers.get("Retry-After", "")
+            await asyncio.sleep(
+                float(retry_after) if retry_after.isdigit() else HTTP_BACKOFF * 2 ** attempt
+            )
         if not data.get("success") or not data.get("data"):
             print(f"No kline data for {symbol}")
             return None
         klines = data["data"]
-        df = pd.DataFrame({
-            "open_time": klines["time"],
-            "open": klines["open"],
-            "high": klines["high"],
-            "low": klines["low"],
-            "close": klines["close"],
-            "vol": klines["vol"],
-            "amount": klines["amount"],
-        })
-        df["close"] = df["close"].astype(float)
-        df = df.sort_values("open_time").reset_index(drop=True)
-        if len(df) < RSI_PERIOD + 10:
-            print(f"Too few candles for {symbol} ({len(df)})")
-            return None
-        return df
+        times = np.asarray(klines["time"], dtype=np.int64)
+        closes = np.asarray(klines["close"], dtype=np.float64)
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind="stable")
+            times, closes = times[order], closes[order]
+        return times, closes
     except Exception as e:
         print(f"Klines failed for {symbol}: {e}")
         return None
@@ -146,9 +326,23 @@ def get_4h_klines(symbol: str) -> pd.DataFrame | None:
 # ──────────────────────────────────────────────
 # MAIN SCAN
 # ──────────────────────────────────────────────
-def run_scan():
-    now = datetime.utcnow()
+async def run_scan():
+    # One session for the whole scan (MEXC + Telegram) so connections are reused
+    connector = aiohttp.TCPConnector(limit=KLINES_CONCURRENCY, limit_per_host=KLINES_CONCURRENCY)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=10)
+    ) as http:
+        # Created here so they bind to the running event loop
+        kline_sem = asyncio.Semaphore(KLINES_CONCURRENCY)  # bounded in-flight kline requests
+        kline_limiter = AsyncLimiter(MEXC_MAX_RPM, 60)  # MEXC per-minute budget
+        telegram_limiter = AsyncLimiter(1, TELEGRAM_MIN_INTERVAL)  # ~1 msg/s per chat
+        await scan(http, kline_sem, kline_limiter, telegram_limiter)
+
+async def scan(http: aiohttp.ClientSession, kline_sem: asyncio.Semaphore,
+               kline_limiter: AsyncLimiter, telegram_limiter: AsyncLimiter):
+    now = datetime.now(timezone.utc)
     now_str = now.strftime('%Y-%m-%d %H:%M:%S UTC')
+    now_fmt = now.strftime("%Y-%m-%d %H:%M UTC")  # alert timestamp, formatted once per scan
     current_hour = now.hour
     is_reset = (current_hour % 4 == 0)
     print(f"[{now_str}] Starting MEXC 4h RSI > {RSI_OVERBOUGHT} scan... (Reset: {is_reset})")
@@ -162,31 +356,49 @@ def run_scan():
         print("No tickers received → exiting")
         return
 
+    tickers = [t for t in tickers if t.get("symbol")]
     print(f"Scanning top {len(tickers)} USDT perpetual pairs...")
-    hits = []
-    for ticker in tickers:
-        symbol = ticker.get("symbol")
-        if not symbol:
-            continue
-        df = get_4h_klines(symbol)
-        if df is None:
-            time.sleep(0.7)
+    closes_mm, index = load_closes_store()
+    index = assign_rows(index, [t["symbol"] for t in tickers])
+    results = await asyncio.gather(
+        *[
+            get_4h_klines(http, kline_sem, kline_limiter, t["symbol"],
+                          fetch_start(index[t["symbol"]]))
+            for t in tickers
+        ],
+        return_exceptions=True,
+    )
+
+    fetched = []
+    for ticker, klines in zip(tickers, results):
+        if not isinstance(klines, tuple):
             continue
-        rsi_series = calculate_rsi(df["close"], RSI_PERIOD)
-        latest_rsi = rsi_series.iloc[-1]
-        if pd.isna(latest_rsi):
-            time.sleep(0.7)
+        entry = index[ticker["symbol"]]
+        update_closes_row(closes_mm[entry["row"]], entry, *klines)
+        if entry["count"] < RSI_PERIOD + 10:
+            print(f"Too few candles for {ticker['symbol']} ({entry['count']})")
             continue
-        if latest_rsi > RSI_OVERBOUGHT:
-            volume_usdt = float(ticker.get("amount24", 0))
-            alert_data = {
-                "symbol": symbol,
-                "symbol_clean": symbol.replace("_", ""),
-                "rsi": latest_rsi,
-                "volume_usdt": volume_usdt
-            }
-            hits.append(alert_data)
-        time.sleep(0.9)
+        fetched.append((ticker, entry))
+    save_closes_store(closes_mm, index)
+
+    rows = [entry["row"] for _, entry in fetched]
+    lengths = np.array([entry["count"] for _, entry in fetched], dtype=np.int64)
+    # float32 is ample for RSI at 2 decimals and halves the kernel's bandwidth
+    mat = np.asarray(closes_mm)[rows].astype(np.float32)
+    rsis = rsi_last_batch(mat, lengths)
+
+    hits = []
+    for i in np.where(rsis > RSI_OVERBOUGHT)[0]:
+        ticker = fetched[i][0]
+        symbol = ticker["symbol"]
+        volume_usdt = float(ticker.get("amount24") or 0)
+        alert_data = {
+            "symbol": symbol,
+            "rsi": float(rsis[i]),
+            "volume_usdt": volume_usdt,
+            "now": now_fmt,
+        }
+        hits.append(alert_data)
 
     if not hits:
         print("No pairs with 4h RSI > 80 found.")
@@ -203,16 +415,13 @@ def run_scan():
         previous_symbols = set(state.get("alerted_symbols", []))
         alert_hits = [hit for hit in hits if hit["symbol"] not in previous_symbols]
 
+    # Sends run in the background while state is saved
+    alert_task = None
     if alert_hits:
+        messages = [ALERT_TEMPLATE.format_map(hit) for hit in alert_hits]
+        alert_task = asyncio.create_task(send_alerts(http, telegram_limiter, messages))
         for hit in alert_hits:
-            message = ALERT_TEMPLATE.format(
-                now=now.strftime("%Y-%m-%d %H:%M UTC"),
-                **hit
-            )
-            success = send_telegram(message)
-            status = "OK" if success else "FAILED"
-            print(f"→ {hit['symbol']} RSI {hit['rsi']:.1f} → {status}")
-            time.sleep(1.6)
+            print(f"→ {hit['symbol']} RSI {hit['rsi']:.1f}")
     else:
         print("No new alerts to send this hour.")
 
@@ -224,5 +433,9 @@ def run_scan():
             "alerted_symbols": alerted_symbols
         })
 
+    for i, success in enumerate(await alert_task if alert_task else []):
+        status = "OK" if success else "FAILED"
+        print(f"→ Telegram batch {i + 1} → {status}")
+
 if __name__ == "__main__":
-    run_scan()
+    asyncio.run(run_scan())